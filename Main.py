@@ -4,11 +4,33 @@ import re
 import os
 import json
 import argparse
-from dataclasses import dataclass, field, asdict
-from typing import List, Dict, Union, Optional, Tuple, Any
+import io
+import mmap
+import stat
+import functools
+import itertools
+import operator
+from collections import deque
+from dataclasses import dataclass, field, asdict, replace
+from typing import List, Dict, Union, Optional, Tuple, Any, Callable, Iterator, Sequence
 from enum import Enum, auto
 import readline  # For command history
 
+try:
+    import ahocorasick  # Optional, for OR groups of many literals
+except ImportError:
+    ahocorasick = None
+
+try:
+    import re2  # Optional, a linear-time engine for patterns that could backtrack badly
+except ImportError:
+    re2 = None
+
+try:
+    import orjson  # Optional, for faster compact JSON output
+except ImportError:
+    orjson = None
+
 # Define the core query model using dataclasses for clarity
 class CommandType(Enum):
     FIND = auto()
@@ -30,7 +52,7 @@ class LogicType(Enum):
     AND = auto()
     OR = auto()
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Condition:
     type: ConditionType
     value: str
@@ -38,7 +60,7 @@ class Condition:
     logic: LogicType = LogicType.AND
     quantifier: Optional[str] = None  # For repeat conditions
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Modifiers:
     ignore_case: bool = False
     multiline: bool = False
@@ -46,7 +68,10 @@ class Modifiers:
     whole_word: bool = False
     context_lines: int = 0
 
-@dataclass
+# A compiled condition: takes a line or word and returns a truthy value on a match
+Predicate = Callable[[str], Any]
+
+@dataclass(slots=True)
 class Query:
     command: CommandType = CommandType.FIND
     target: TargetType = TargetType.LINES
@@ -65,23 +90,40 @@ class TokenType(Enum):
     IDENTIFIER = auto()
     EOF = auto()
 
-@dataclass
+@dataclass(slots=True)
 class Token:
     type: TokenType
     value: str
     line: int
     column: int
 
+# All lexemes of the query language in one pattern, compiled once at import;
+# the tokenizer dispatches on the name of the group that matched
+_TOKEN_RE = re.compile(r"""
+    \s*                                                      # Leading whitespace is skipped
+    (?:
+        (?P<STRING>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')  # Backslash escapes are kept as-is
+      | (?P<UNTERMINATED>["'])
+      | (?P<NUMBER>\d+)
+      | (?P<WORD>[^\W\d]\w*)
+      | (?P<OPERATOR>[=<>!&|]+)
+    )
+""", re.VERBOSE | re.DOTALL)
+
 class Parser:
     """A simple recursive descent parser for our query language"""
     
-    KEYWORDS = {
+    KEYWORDS = frozenset({
         "SELECT", "FROM", "WHERE", "AND", "OR", "NOT", 
         "LINES", "WORDS", "CONTAINS", "STARTS", "ENDS", "WITH",
         "MATCHES", "IGNORE", "CASE", "WHOLE", "WORD", "EXTRACT",
         "COUNT", "BEFORE", "AFTER", "CONTEXT", "AS", "JSON", "CSV",
         "AT", "LEAST", "MOST", "EXACTLY", "BETWEEN", "TIMES"
-    }
+    })
+    
+    # Keyword tokens all share one interned string per keyword, so the
+    # parser's comparisons against them succeed on identity
+    KEYWORD_VALUES = {keyword: sys.intern(keyword) for keyword in KEYWORDS}
     
     def __init__(self, query_text: str):
         self.text = query_text
@@ -96,72 +138,53 @@ class Parser:
         line = 1
         column = 1
         
-        while i < len(text):
-            # Skip whitespace
-            if text[i].isspace():
-                if text[i] == '\n':
-                    line += 1
-                    column = 1
-                else:
-                    column += 1
-                i += 1
-                continue
-                
-            # Handle quoted strings
-            if text[i] in ('"', "'"):
-                quote_char = text[i]
-                start = i
-                i += 1
-                while i < len(text) and text[i] != quote_char:
-                    if text[i] == '\\' and i + 1 < len(text):
-                        i += 2  # Skip escaped character
-                    else:
-                        i += 1
-                if i < len(text):
-                    value = text[start+1:i]  # Extract without quotes
-                    tokens.append(Token(TokenType.STRING, value, line, column))
-                    column += (i - start + 1)
-                    i += 1  # Skip closing quote
-                else:
-                    raise SyntaxError(f"Unterminated string at line {line}, column {column}")
-                continue
-                
-            # Handle numbers
-            if text[i].isdigit():
-                start = i
-                while i < len(text) and text[i].isdigit():
-                    i += 1
-                value = text[start:i]
-                tokens.append(Token(TokenType.NUMBER, value, line, column))
-                column += (i - start)
-                continue
+        # Names used for every token are bound locally
+        append = tokens.append
+        keywords = self.KEYWORD_VALUES
+        rfind = text.rfind
+        KEYWORD, IDENTIFIER, STRING, NUMBER, OPERATOR = (
+            TokenType.KEYWORD, TokenType.IDENTIFIER, TokenType.STRING, TokenType.NUMBER, TokenType.OPERATOR)
+        
+        # finditer steps over characters that can't start a token, so positions
+        # alone tell how far the line and column have moved between tokens
+        for match in _TOKEN_RE.finditer(text):
+            kind = match.lastgroup
+            start, end = match.span(match.lastindex)
+            value = text[start:end]
+            
+            # Account for the whitespace and stray characters skipped before the token
+            last_newline = rfind('\n', i, start)
+            if last_newline >= 0:
+                line += text.count('\n', i, start)
+                column = start - last_newline
+            else:
+                column += start - i
                 
-            # Handle keywords and identifiers
-            if text[i].isalpha() or text[i] == '_':
-                start = i
-                while i < len(text) and (text[i].isalnum() or text[i] == '_'):
-                    i += 1
-                value = text[start:i]
-                if value.upper() in self.KEYWORDS:
-                    tokens.append(Token(TokenType.KEYWORD, value.upper(), line, column))
+            if kind == "WORD":
+                keyword = keywords.get(value.upper())
+                if keyword:
+                    append(Token(KEYWORD, keyword, line, column))
                 else:
-                    tokens.append(Token(TokenType.IDENTIFIER, value, line, column))
-                column += (i - start)
-                continue
+                    append(Token(IDENTIFIER, value, line, column))
+            elif kind == "STRING":
+                append(Token(STRING, value[1:-1], line, column))  # Extract without quotes
+            elif kind == "UNTERMINATED":
+                raise SyntaxError(f"Unterminated string at line {line}, column {column}")
+            elif kind == "NUMBER":
+                append(Token(NUMBER, value, line, column))
+            else:  # OPERATOR
+                append(Token(OPERATOR, value, line, column))
                 
-            # Handle operators
-            if text[i] in "=<>!&|":
-                start = i
-                while i < len(text) and text[i] in "=<>!&|":
-                    i += 1
-                value = text[start:i]
-                tokens.append(Token(TokenType.OPERATOR, value, line, column))
-                column += (i - start)
-                continue
-                
-            # Skip other characters
-            i += 1
-            column += 1
+            column += end - start
+            i = end
+            
+        # Skip whatever trails the last token
+        last_newline = text.rfind('\n', i)
+        if last_newline >= 0:
+            line += text.count('\n', i)
+            column = len(text) - last_newline
+        else:
+            column += len(text) - i
             
         # Add EOF token
         tokens.append(Token(TokenType.EOF, "", line, column))
@@ -260,14 +283,12 @@ class Parser:
             if self._optional(TokenType.KEYWORD, "NOT"):
                 negated = True
                 
-            next_condition = self._parse_condition()
-            next_condition.logic = logic
-            next_condition.negated = negated
+            next_condition = self._parse_condition(logic, negated)
             conditions.append(next_condition)
             
         return conditions
         
-    def _parse_condition(self) -> Condition:
+    def _parse_condition(self, logic: LogicType = LogicType.AND, negated: bool = False) -> Condition:
         """Parse a single condition"""
         # Default
         condition_type = ConditionType.CONTAINS
@@ -316,6 +337,8 @@ class Parser:
         return Condition(
             type=condition_type,
             value=value_token.value,
+            negated=negated,
+            logic=logic,
             quantifier=quantifier
         )
         
@@ -324,71 +347,366 @@ class Parser:
         while True:
             if self._optional(TokenType.KEYWORD, "IGNORE"):
                 if self._optional(TokenType.KEYWORD, "CASE"):
-                    query.modifiers.ignore_case = True
+                    query.modifiers = replace(query.modifiers, ignore_case=True)
                     
             elif self._optional(TokenType.KEYWORD, "WHOLE"):
                 if self._optional(TokenType.KEYWORD, "WORD"):
-                    query.modifiers.whole_word = True
+                    query.modifiers = replace(query.modifiers, whole_word=True)
                     
             elif self._optional(TokenType.KEYWORD, "MULTILINE"):
-                query.modifiers.multiline = True
+                query.modifiers = replace(query.modifiers, multiline=True)
                 
             elif self._optional(TokenType.KEYWORD, "DOTALL"):
-                query.modifiers.dotall = True
+                query.modifiers = replace(query.modifiers, dotall=True)
                 
             elif self._optional(TokenType.KEYWORD, "CONTEXT"):
                 num = self._expect(TokenType.NUMBER).value
-                query.modifiers.context_lines = int(num)
+                query.modifiers = replace(query.modifiers, context_lines=int(num))
                 
             else:
                 break  # No more modifiers
 
+# Up to this many OR'ed CONTAINS conditions are checked as plain substrings;
+# past that one regex alternation over all of them is faster
+MAX_SUBSTRING_OR = 3
+
+# Excludes are checked on nearly every item and rarely found, so substring
+# checks stay ahead of the alternation for longer
+MAX_SUBSTRING_EXCLUDES = 8
+
+# From this many OR'ed CONTAINS conditions on, an Aho-Corasick automaton (when
+# pyahocorasick is installed) beats the regex alternation
+MIN_AUTOMATON_OR = 16
+
+# Compiled patterns are shared across queries, e.g. between runs in interactive mode
+@functools.lru_cache(maxsize=256)
+def _compile(pattern: str, flags: int) -> re.Pattern:
+    """Compile a regex, reusing the compiled object when the same pattern comes up again
+
+    Patterns that could take exponential time on a non-matching item are
+    compiled with RE2 when it's installed and reads them the same way, and
+    rejected otherwise.
+    """
+    if QueryBuilder._is_redos_risk(pattern):
+        compiled = _compile_re2(pattern, flags)
+        if compiled is None:
+            raise SyntaxError(f"Pattern '{pattern}' repeats a group that itself repeats, which can take "
+                              f"exponential time to match; rewrite it (e.g. (a+)+ as a+)")
+        return compiled
+    return re.compile(pattern, flags)
+
+# Syntax RE2 lacks or reads differently: lookarounds, backreferences, atomic
+# groups and possessive repeats, and \w, \b, \s and \d, which only know ASCII there
+_RE2_UNSAFE_RE = re.compile(r"\(\?(?:<?[=!]|>|P=)|\\(?:[1-9]|[wWbBsSdD])|[*+?}]\+")
+
+def _compile_re2(pattern: str, flags: int) -> Optional[Any]:
+    """Compile a pattern with RE2 if it's installed and the pattern means the same there, else return None
+
+    The result offers search and findall like a re.Pattern; its match
+    objects offer start, which is all the callers use.
+    """
+    if re2 is None or _RE2_UNSAFE_RE.search(pattern):
+        return None
+        
+    # RE2 takes the flags inline, and reports bad patterns through re2.error only
+    inline = "".join(letter for flag, letter in ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"))
+                     if flags & flag)
+    options = re2.Options()
+    options.log_errors = False
+    try:
+        return re2.compile(f"(?{inline}){pattern}" if inline else pattern, options)
+    except re2.error:
+        return None
+
+# A {m,n} repeat; {} and {,} without numbers don't count as one
+_BRACE_QUANTIFIER_RE = re.compile(r"\{(\d*)(,?)(\d*)\}")
+
+# Parsed queries are kept so a query run again in interactive mode isn't re-parsed
+@functools.lru_cache(maxsize=128)
+def _parse_query(query_text: str) -> Query:
+    """Parse a query string, reusing the result when the same query comes up again"""
+    return Parser(query_text).parse()
+
+def parse_query(query_text: str) -> Query:
+    """Parse a query string into a Query the caller is free to modify"""
+    query = _parse_query(query_text)
+    return replace(query, conditions=list(query.conditions))  # Conditions and modifiers are frozen
+
 # Query builder class for constructing the regex patterns
 class QueryBuilder:
     @staticmethod
-    def build_pattern(query: Query) -> Tuple[str, List[str]]:
-        """Build regex patterns from the query"""
-        include_parts_and = []
-        include_parts_or = []
-        exclude_patterns = []
+    def build_matchers(query: Query, flags: int) -> Tuple[Tuple[Predicate, ...], Optional[Predicate], Tuple[Predicate, ...]]:
+        """Build predicates from the query as (AND predicates, OR predicate, exclude predicates)"""
+        return QueryBuilder._compile_matchers(tuple(query.conditions), query.modifiers, flags)
         
-        # Process each condition
-        for condition in query.conditions:
-            pattern = QueryBuilder._build_condition_pattern(condition, query.modifiers)
-            
-            if condition.negated:
-                exclude_patterns.append(pattern)
-            else:
-                if condition.logic == LogicType.OR:
-                    include_parts_or.append(pattern)
+    @staticmethod
+    def build_matcher(query: Query, flags: int, excludes: bool = True) -> Optional[Predicate]:
+        """Build one predicate telling whether an item matches the query, or None if everything does"""
+        and_preds, or_pred, exclude_preds = QueryBuilder.build_matchers(query, flags)
+        return QueryBuilder._combine_predicates(and_preds, or_pred, exclude_preds if excludes else ())
+        
+    @staticmethod
+    def _combine_predicates(and_preds: Sequence[Predicate], or_pred: Optional[Predicate],
+                            exclude_preds: Sequence[Predicate]) -> Optional[Predicate]:
+        """Fold the predicates into a single closure shaped for the groups that are present"""
+        # Included when every AND predicate holds (stopping at the first
+        # failure) or, failing that, when the OR predicate holds. Searching for
+        # each AND condition on its own is equivalent to one (?=.*p1)(?=.*p2).*
+        # pattern: search already tries every offset, and lines and words never
+        # contain a newline for .* to stop at. It avoids rescanning the item
+        # once per lookahead
+        if not exclude_preds:
+            if not and_preds:
+                return or_pred
+            if len(and_preds) == 1 and not or_pred:
+                return and_preds[0]
+            if len(and_preds) == 2 and not or_pred:
+                first, second = and_preds
+                return lambda item: first(item) and second(item)
+                
+        has_includes = bool(and_preds or or_pred)
+        
+        def matches(item: str) -> bool:
+            if has_includes:
+                for pred in and_preds:
+                    if not pred(item):
+                        if not (or_pred and or_pred(item)):
+                            return False
+                        break
                 else:
-                    include_parts_and.append(pattern)
-                    
-        # Combine patterns
-        if include_parts_and and include_parts_or:
-            # Build AND chain
-            and_chain = "".join(f"(?=.*{p})" for p in include_parts_and) + ".*"
-            # Build OR group
-            or_group = "|".join(include_parts_or)
-            include_pattern = f"(?:({and_chain})|({or_group}))"
-        elif include_parts_and:
-            # Only AND conditions
-            and_chain = "".join(f"(?=.*{p})" for p in include_parts_and) + ".*"
-            include_pattern = and_chain
-        elif include_parts_or:
-            # Only OR conditions
-            or_group = "|".join(include_parts_or)
-            include_pattern = f"(?:{or_group})"
+                    if not and_preds and not or_pred(item):
+                        return False
+                        
+            for pred in exclude_preds:
+                if pred(item):
+                    return False
+            return True
+            
+        return matches
+        
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _compile_matchers(conditions: Tuple[Condition, ...], modifiers: Modifiers,
+                          flags: int) -> Tuple[Tuple[Predicate, ...], Optional[Predicate], Tuple[Predicate, ...]]:
+        """Compile predicates for a set of conditions, reusing earlier results for identical queries"""
+        and_conditions, or_conditions, exclude_conditions = QueryBuilder._group_conditions(conditions)
+        
+        # Cheap, selective checks go first so most items are turned down early
+        and_conditions.sort(key=lambda c: QueryBuilder._check_cost(c, modifiers))
+        and_preds = tuple(QueryBuilder._build_condition_predicate(c, modifiers, flags) for c in and_conditions)
+        
+        # Excludes are checked a group at a time rather than one predicate call
+        # each: those that need the regex engine share one alternation, and plain
+        # CONTAINS share one substring loop, automaton or alternation. MATCHES
+        # patterns keep their own search since inline flags and group references
+        # don't survive being combined
+        fused_excludes = [c for c in exclude_conditions
+                          if c.type != ConditionType.MATCHES and not QueryBuilder._is_plain_text(c, modifiers)
+                          and not QueryBuilder._is_folded_text(c, modifiers)]
+        if len(fused_excludes) < 2:
+            fused_excludes = []
+        plain_excludes = [c for c in exclude_conditions if QueryBuilder._is_plain_contains(c, modifiers)]
+        if len(plain_excludes) < 2:
+            plain_excludes = []
+        exclude_preds = tuple(QueryBuilder._build_condition_predicate(c, modifiers, flags)
+                              for c in exclude_conditions if c not in fused_excludes and c not in plain_excludes)
+        if plain_excludes:
+            exclude_preds += (QueryBuilder._build_any_predicate(plain_excludes, modifiers, flags,
+                                                                MAX_SUBSTRING_EXCLUDES),)
+        if fused_excludes:
+            exclude_preds += (QueryBuilder._build_any_predicate(fused_excludes, modifiers, flags),)
+                
+        or_pred = QueryBuilder._build_any_predicate(or_conditions, modifiers, flags) if or_conditions else None
+        return and_preds, or_pred, exclude_preds
+        
+    @staticmethod
+    def _build_any_predicate(conditions: List[Condition], modifiers: Modifiers, flags: int,
+                             max_substring: int = MAX_SUBSTRING_OR) -> Predicate:
+        """Build one predicate for a group of conditions that is truthy when any of them matches"""
+        # A lone condition gets its own predicate. A few plain CONTAINS are
+        # quicker as substring checks and many are quicker as one automaton;
+        # anything else shares one alternation
+        plain = all(QueryBuilder._is_plain_contains(c, modifiers) for c in conditions)
+        if len(conditions) == 1:
+            any_pred = QueryBuilder._build_condition_predicate(conditions[0], modifiers, flags)
+        elif len(conditions) <= max_substring and plain:
+            needles = tuple(c.value for c in conditions)
+            
+            def any_pred(item: str) -> bool:
+                for needle in needles:
+                    if needle in item:
+                        return True
+                return False
+        elif (len(conditions) >= MIN_AUTOMATON_OR and plain and ahocorasick and ahocorasick.unicode
+                and all(c.value for c in conditions)):
+            automaton = ahocorasick.Automaton()
+            for condition in conditions:
+                automaton.add_word(condition.value, condition.value)
+            automaton.make_automaton()
+            find_all = automaton.iter
+            
+            def any_pred(item: str) -> bool:
+                for _ in find_all(item):
+                    return True
+                return False
         else:
-            # No include conditions
-            include_pattern = ".*"
+            any_pred = _compile(QueryBuilder._build_or_pattern(conditions, modifiers), flags).search
+        return any_pred
+        
+    @staticmethod
+    def _is_plain_contains(condition: Condition, modifiers: Modifiers) -> bool:
+        """Return True if the condition is a literal substring test"""
+        return (condition.type == ConditionType.CONTAINS
+                and not modifiers.ignore_case and not modifiers.whole_word)
+        
+    @staticmethod
+    def _check_cost(condition: Condition, modifiers: Modifiers) -> Tuple[int, int]:
+        """Rank a condition by how cheap and how selective its check is likely to be"""
+        # str methods beat lowercasing, which beats the regex engine; among
+        # literals the longer ones are less likely to be found
+        if QueryBuilder._is_plain_text(condition, modifiers):
+            return 0, -len(condition.value)
+        if QueryBuilder._is_folded_text(condition, modifiers):
+            return 1, -len(condition.value)
+        return 2, 0
+        
+    @staticmethod
+    def _is_plain_text(condition: Condition, modifiers: Modifiers) -> bool:
+        """Return True if the condition is checked with a str method rather than a regex"""
+        return (condition.type in (ConditionType.CONTAINS, ConditionType.STARTS_WITH, ConditionType.ENDS_WITH)
+                and not modifiers.ignore_case and not modifiers.whole_word)
+        
+    @staticmethod
+    def _is_folded_text(condition: Condition, modifiers: Modifiers) -> bool:
+        """Return True if the condition is an ignore-case literal that lowercasing can decide for ASCII items"""
+        return (condition.type in (ConditionType.CONTAINS, ConditionType.STARTS_WITH, ConditionType.ENDS_WITH)
+                and modifiers.ignore_case and not modifiers.whole_word and condition.value.isascii())
+        
+    @staticmethod
+    def build_scan_pattern(query: Query) -> Optional[str]:
+        """Build a pattern that finds candidate lines across a whole block of text, if the query allows it"""
+        # Only conditions on literal text qualify: under re.MULTILINE their
+        # patterns (word boundaries included) hit a line inside a block exactly
+        # when they hit it on its own. MATCHES patterns may use \A, lookbehinds
+        # and the like, which see past the line
+        and_conditions, or_conditions, _ = QueryBuilder._group_conditions(query.conditions)
+        literal_and = [c for c in and_conditions if c.type != ConditionType.MATCHES]
+        if (and_conditions and not literal_and) or any(c.type == ConditionType.MATCHES for c in or_conditions):
+            return None
             
-        # Apply whole word boundaries if needed
-        if query.modifiers.whole_word:
-            include_pattern = rf"\b(?:{include_pattern})\b"
-            exclude_patterns = [rf"\b(?:{p})\b" for p in exclude_patterns]
+        # Every matching line is hit by one AND condition or by the OR group, and
+        # candidates are checked against the whole query, excludes included. Any
+        # one AND condition will do, and the longest literal skips the most text
+        parts = []
+        if literal_and:
+            condition = min(literal_and, key=lambda c: QueryBuilder._check_cost(c, query.modifiers))
+            parts.append(QueryBuilder._build_condition_pattern(condition, query.modifiers))
+        if or_conditions:
+            parts.append(QueryBuilder._build_or_pattern(or_conditions, query.modifiers))
+            
+        if len(parts) > 1:
+            return "|".join(f"(?:{p})" for p in parts)
+        return parts[0] if parts else None
+        
+    @staticmethod
+    def build_scan_literal(query: Query) -> Optional[str]:
+        """Return text that every matching line contains, if str.find can look for it across a whole block
+
+        Under IGNORE CASE the text is returned lowercased, to be looked for in
+        lowercased blocks.
+        """
+        and_conditions, or_conditions, _ = QueryBuilder._group_conditions(query.conditions)
+        if not and_conditions or or_conditions:
+            return None
             
-        return include_pattern, exclude_patterns
+        # An empty needle or one spanning a line break can't be found block-wide
+        condition = min(and_conditions, key=lambda c: QueryBuilder._check_cost(c, query.modifiers))
+        if (condition.type != ConditionType.CONTAINS or not condition.value or "\n" in condition.value
+                or not (QueryBuilder._is_plain_text(condition, query.modifiers)
+                        or QueryBuilder._is_folded_text(condition, query.modifiers))):
+            return None
+        return condition.value.lower() if query.modifiers.ignore_case else condition.value
+        
+    @staticmethod
+    def extraction_decides_match(query: Query) -> bool:
+        """Return True if an item matches exactly when the extraction pattern is found in it"""
+        if len(query.conditions) != 1 or query.modifiers.whole_word:
+            return False
+        condition = query.conditions[0]
+        return (condition.type == ConditionType.MATCHES and not condition.negated
+                and condition.value == query.extraction_pattern)
+        
+    @staticmethod
+    def includes_imply_line_match(query: Query) -> bool:
+        """Return True if a word can only pass the include conditions when its whole line does"""
+        # Unanchored searches found in a word are found in its line too; word
+        # edges sit next to whitespace, so even \b boundaries behave the same
+        includes = [c for c in query.conditions if not c.negated]
+        return bool(includes) and all(
+            c.type in (ConditionType.CONTAINS, ConditionType.REPEAT) for c in includes)
+        
+    @staticmethod
+    def _group_conditions(conditions: Sequence[Condition]) -> Tuple[List[Condition], List[Condition], List[Condition]]:
+        """Split the query conditions into AND, OR and exclude groups"""
+        and_conditions = []
+        or_conditions = []
+        exclude_conditions = []
+        
+        for condition in conditions:
+            if condition.negated:
+                exclude_conditions.append(condition)
+            elif condition.logic == LogicType.OR:
+                or_conditions.append(condition)
+            else:
+                and_conditions.append(condition)
+                
+        return and_conditions, or_conditions, exclude_conditions
+        
+    @staticmethod
+    def _build_or_pattern(conditions: List[Condition], modifiers: Modifiers) -> Optional[str]:
+        """Combine OR conditions into a single alternation"""
+        if not conditions:
+            return None
+        return "|".join(f"(?:{QueryBuilder._build_condition_pattern(c, modifiers)})" for c in conditions)
+        
+    @staticmethod
+    def _build_condition_predicate(condition: Condition, modifiers: Modifiers, flags: int) -> Predicate:
+        """Build a predicate for a single condition"""
+        # Plain text conditions are cheaper to check with str methods than with the regex engine
+        if QueryBuilder._is_plain_text(condition, modifiers):
+            text = condition.value
+            if condition.type == ConditionType.CONTAINS:
+                return lambda item: text in item
+            elif condition.type == ConditionType.STARTS_WITH:
+                return lambda item: item.startswith(text)
+            elif condition.type == ConditionType.ENDS_WITH:
+                return lambda item: item.endswith(text)
+                
+        # Ignore-case literals compare lowercased text, which agrees with re.IGNORECASE
+        # on ASCII items; anything else still goes through the regex engine
+        if QueryBuilder._is_folded_text(condition, modifiers):
+            text = condition.value.lower()
+            search = _compile(QueryBuilder._build_condition_pattern(condition, modifiers), flags).search
+            if condition.type == ConditionType.CONTAINS:
+                return lambda item: text in item.lower() if item.isascii() else search(item)
+            elif condition.type == ConditionType.STARTS_WITH:
+                return lambda item: item.lower().startswith(text) if item.isascii() else search(item)
+            else:
+                return lambda item: item.lower().endswith(text) if item.isascii() else search(item)
+                
+        # Whole-word literals can only be found where the text itself is, so a
+        # str check turns down most items before the bounded search runs
+        search = _compile(QueryBuilder._build_condition_pattern(condition, modifiers), flags).search
+        if modifiers.whole_word and not modifiers.ignore_case:
+            text = condition.value
+            if condition.type == ConditionType.CONTAINS:
+                return lambda item: text in item and search(item)
+            elif condition.type == ConditionType.STARTS_WITH:
+                return lambda item: item.startswith(text) and search(item)
+            elif condition.type == ConditionType.ENDS_WITH:
+                return lambda item: item.endswith(text) and search(item)
+                
+        return search
         
     @staticmethod
     def _build_condition_pattern(condition: Condition, modifiers: Modifiers) -> str:
@@ -398,24 +716,131 @@ class QueryBuilder:
         text = condition.value if is_regex else re.escape(condition.value)
         
         if condition.type == ConditionType.STARTS_WITH:
-            return f"^{text}"
+            pattern = f"^{text}"
         elif condition.type == ConditionType.ENDS_WITH:
-            return f"{text}$"
+            pattern = f"{text}$"
         elif condition.type == ConditionType.CONTAINS:
-            return text
+            pattern = text
         elif condition.type == ConditionType.MATCHES:
-            return text
+            pattern = text
         elif condition.type == ConditionType.REPEAT:
             quantifier = condition.quantifier if condition.quantifier else "{1,}"
-            return f"(?:{text}){quantifier}"
+            # Nothing follows the repeat unless word boundaries are added, so
+            # it can be possessive and never backtrack into the repetitions
+            if not modifiers.whole_word:
+                quantifier += "+"
+            pattern = f"(?:{text}){quantifier}"
         else:
-            return text  # Default fallback
+            pattern = text  # Default fallback
+            
+        # Apply whole word boundaries if needed
+        if modifiers.whole_word:
+            pattern = rf"\b(?:{pattern})\b"
+            
+        return pattern
+
+    @staticmethod
+    def _is_redos_risk(pattern: str) -> bool:
+        """Return True if the pattern repeats a group that can end in an unbounded repeat, like (a+)+
+
+        Such a group can split the same text between its iterations in many
+        ways. When something required follows the inner repeat, as the comma in
+        ([^,]+,)+ does, each iteration has to end there and matching stays linear.
+        """
+        # One entry per open group: whether the current branch so far ends in
+        # an unbounded repeat followed by nothing required, whether an earlier
+        # branch did, and whether the group is atomic and never backtracks
+        tail = [False]
+        ended = [False]
+        atomic = [False]
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if char == "(":
+                tail.append(False)
+                ended.append(False)
+                atomic.append(pattern.startswith("(?>", i))
+                i += 1
+                continue
+            if char == "|":
+                ended[-1] = ended[-1] or tail[-1]
+                tail[-1] = False
+                i += 1
+                continue
+                
+            # Step over one atom, then see how it's repeated
+            group_tail = False
+            if char == "\\":
+                i += 2
+            elif char == "[":
+                # Skip the class; a ] straight after [ or [^ is part of it
+                i += 1
+                if pattern.startswith("^", i):
+                    i += 1
+                if pattern.startswith("]", i):
+                    i += 1
+                while i < len(pattern) and pattern[i] != "]":
+                    i += 2 if pattern[i] == "\\" else 1
+                i += 1
+            else:
+                if char == ")" and len(tail) > 1:
+                    branch_tail, earlier_tail, is_atomic = tail.pop(), ended.pop(), atomic.pop()
+                    group_tail = (branch_tail or earlier_tail) and not is_atomic
+                i += 1
+            minimum, unbounded, possessive, i = QueryBuilder._read_quantifier(pattern, i)
+            
+            if unbounded and not possessive:
+                if group_tail:
+                    return True
+                tail[-1] = True
+            elif group_tail:
+                tail[-1] = True  # The group's own repeat can still end this branch
+            elif minimum:
+                tail[-1] = False  # Something required follows any earlier repeat
+                
+        return False
+        
+    @staticmethod
+    def _read_quantifier(pattern: str, i: int) -> Tuple[int, bool, bool, int]:
+        """Read the quantifier at i, if any, as (minimum, unbounded, possessive, index after it)"""
+        if pattern.startswith("*", i):
+            minimum, unbounded = 0, True
+            i += 1
+        elif pattern.startswith("+", i):
+            minimum, unbounded = 1, True
+            i += 1
+        elif pattern.startswith("?", i):
+            minimum, unbounded = 0, False
+            i += 1
+        else:
+            m = _BRACE_QUANTIFIER_RE.match(pattern, i)
+            if not m or not (m.group(1) or m.group(2)):
+                return 1, False, False, i  # A single required atom
+            minimum, unbounded = int(m.group(1) or 0), bool(m.group(2)) and not m.group(3)
+            i = m.end()
+            
+        # A lazy repeat still backtracks; a possessive one doesn't
+        if pattern.startswith("?", i):
+            return minimum, unbounded, False, i + 1
+        if pattern.startswith("+", i):
+            return minimum, unbounded, True, i + 1
+        return minimum, unbounded, False, i
+
+# Size of the chunks input files are read in
+BLOCK_SIZE = 1 << 20
+
+# Number of streamed output lines gathered before each write
+OUTPUT_BATCH = 1024
 
 # Query executor class for processing files against queries
 class QueryExecutor:
     @staticmethod
-    def execute(query: Query, input_source=None) -> Dict[str, Any]:
-        """Execute a query against input text data"""
+    def execute(query: Query, input_source=None, output=None) -> Dict[str, Any]:
+        """Execute a query against input text data
+
+        If an output stream is given, FIND and EXTRACT results are written to it
+        in text format as they are found instead of being collected.
+        """
         # Set up regex flags
         flags = 0
         if query.modifiers.ignore_case:
@@ -425,14 +850,15 @@ class QueryExecutor:
         if query.modifiers.dotall:
             flags |= re.DOTALL
             
-        # Build the regex patterns
-        include_pattern, exclude_patterns = QueryBuilder.build_pattern(query)
+        # Build the matchers once for the whole run
+        matches = QueryBuilder.build_matcher(query, flags)  # None when every item matches
+        extraction_re = _compile(query.extraction_pattern, flags) if query.extraction_pattern else None
         
         # Decide the input source
         if input_source is None:
             if query.file_pattern and query.file_pattern.strip():
                 try:
-                    input_file = open(query.file_pattern, "r", encoding="utf-8", errors="ignore")
+                    input_file = open(query.file_pattern, "rb")
                 except FileNotFoundError:
                     return {"error": f"File not found: {query.file_pattern}"}
             else:
@@ -441,106 +867,426 @@ class QueryExecutor:
             # Allow passing an already open file-like object
             input_file = input_source
         
-        # Process the input
+        # Process the input. Matches are kept column-wise, one list per field,
+        # rather than as a dict apiece; context blocks are (line, content, type)
+        # tuples and None for matches without one
         results = {
             "command": query.command.name,
             "target": query.target.name,
             "matched_count": 0,
-            "matched_items": [],
+            "match_lines": [],
+            "match_contents": [],
+            "match_contexts": [],
             "extracted_items": []
         }
         
-        # Read all lines (for context line support)
-        lines = input_file.readlines()
-        
-        # If the input was a file we opened, close it
-        if input_source is None and query.file_pattern and query.file_pattern.strip():
-            input_file.close()
+        # Decide where matches go: straight to the output stream, or into the results
+        streaming = output is not None and query.command != CommandType.COUNT
+        if streaming:
+            # Formatted lines are batched so the stream sees a few large writes
+            pending = []
             
-        # Process lines based on target type
-        if query.target == TargetType.WORDS:
-            for i, line in enumerate(lines):
-                line_stripped = line.rstrip("\n")
-                words = line_stripped.split()
+            def add_match(line: int, content: str, context: Optional[List[Tuple[int, str, str]]] = None):
+                pending.append(OutputFormatter.format_text_item(line, content, context))
+                if len(pending) >= OUTPUT_BATCH:
+                    flush_pending()
+                    
+            def add_extracted(ex: str):
+                pending.append(ex)
+                if len(pending) >= OUTPUT_BATCH:
+                    flush_pending()
+                    
+            def flush_pending():
+                output.write("\n".join(pending) + "\n")
+                pending.clear()
                 
-                for word in words:
-                    if QueryExecutor._matches_item(word, include_pattern, exclude_patterns, flags):
-                        results["matched_count"] += 1
+            collect_matches = query.command == CommandType.FIND
+        else:
+            collect_matches = query.command in (CommandType.FIND, CommandType.EXTRACT)
+            add_line = results["match_lines"].append
+            add_content = results["match_contents"].append
+            add_context = results["match_contexts"].append
+            add_extracted = results["extracted_items"].append
+            
+            def add_match(line: int, content: str, context: Optional[List[Tuple[int, str, str]]] = None):
+                add_line(line)
+                add_content(content)
+                add_context(context)
+        
+        # Lines are read lazily so only the context window is held in memory.
+        # Files we opened ourselves are read in large binary blocks; other
+        # streams in large text chunks that are split into lines
+        own_file = input_source is None and bool(query.file_pattern and query.file_pattern.strip())
+        try:
+            numbered_lines = None
+            if own_file:
+                # Lines that can't match are skipped unless they're needed as context
+                scan_literal = scan_pattern = None
+                if query.target == TargetType.LINES and (query.modifiers.context_lines == 0
+                                                         or query.command == CommandType.COUNT):
+                    scan_literal = QueryBuilder.build_scan_literal(query)
+                    if not scan_literal:
+                        scan_pattern = QueryBuilder.build_scan_pattern(query)
                         
-                        if query.command == CommandType.FIND:
-                            results["matched_items"].append({"line": i+1, "content": word})
-                            
-                        if query.command == CommandType.EXTRACT and query.extraction_pattern:
-                            extracted = re.findall(query.extraction_pattern, word, flags=flags)
-                            for ex in extracted:
-                                if isinstance(ex, tuple):
-                                    results["extracted_items"].append(" ".join(ex))
-                                else:
-                                    results["extracted_items"].append(ex)
-        else:  # TargetType.LINES
-            for i, line in enumerate(lines):
-                line_stripped = line.rstrip("\n")
+                blocks = QueryExecutor._iter_blocks(input_file)
+                fold_re = None
+                if scan_literal and query.modifiers.ignore_case:
+                    # Blocks are lowercased once for the literal; blocks beyond ASCII,
+                    # where that isn't the same as ignoring case, are searched with this
+                    fold_re = _compile(re.escape(scan_literal), flags | re.MULTILINE)
+                    
+                if scan_literal and query.command == CommandType.COUNT and len(query.conditions) == 1:
+                    # Matching lines can be counted straight off the blocks with str.find
+                    results["matched_count"] = QueryExecutor._count_literal_lines(blocks, scan_literal, fold_re)
+                    return results
+                elif scan_literal:
+                    # Let str.find skip over lines without the literal a whole block at a time
+                    numbered_lines = QueryExecutor._find_candidates(blocks, scan_literal, fold_re)
+                    if len(query.conditions) == 1:
+                        matches = None  # Every candidate line already contains the literal
+                elif scan_pattern:
+                    # Let the regex engine skip over non-matching lines a whole block at a time
+                    scan_re = _compile(scan_pattern, flags | re.MULTILINE)
+                    numbered_lines = QueryExecutor._scan_candidates(blocks, scan_re)
+                else:
+                    lines = itertools.chain.from_iterable(map(QueryExecutor._split_lines, blocks))
+            else:
+                lines = QueryExecutor._iter_text_lines(input_file)
+            if numbered_lines is None:
+                numbered_lines = enumerate(lines)
                 
-                if QueryExecutor._matches_item(line_stripped, include_pattern, exclude_patterns, flags):
-                    results["matched_count"] += 1
+            # Extraction runs once per matching item; when the query only asks
+            # for items its pattern is found in, that one pass also does the matching
+            extract_all = None
+            if query.command == CommandType.EXTRACT and extraction_re:
+                extract_all = extraction_re.findall
+            extraction_decides = bool(extract_all) and QueryBuilder.extraction_decides_match(query)
+            
+            # Counting needs no match items, context or extraction at all
+            if query.command == CommandType.COUNT:
+                results["matched_count"] = QueryExecutor._execute_count(query, numbered_lines, matches, flags)
                     
-                    if query.command in (CommandType.FIND, CommandType.EXTRACT):
-                        # Add context lines if specified
-                        context_lines = []
+            # Process lines based on target type
+            elif query.target == TargetType.WORDS:
+                # When no word can pass the include conditions unless its whole
+                # line does, lines that fail them are not split at all
+                line_matches = None
+                if QueryBuilder.includes_imply_line_match(query):
+                    line_matches = QueryBuilder.build_matcher(query, flags, excludes=False)
+                    
+                # The loop only touches locals; the count goes into the results at the end
+                matched_count = 0
+                find_words = query.command == CommandType.FIND
+                
+                for i, line_stripped in numbered_lines:
+                    if line_matches and not line_matches(line_stripped):
+                        continue
                         
-                        if query.modifiers.context_lines > 0:
-                            # Add before lines
-                            start_idx = max(0, i - query.modifiers.context_lines)
-                            context_lines.extend([
-                                {"line": j+1, "content": lines[j].rstrip("\n"), "type": "before"}
-                                for j in range(start_idx, i)
-                            ])
+                    words = line_stripped.split()
+                    
+                    for word in words:
+                        if extraction_decides:
+                            extracted = extract_all(word)  # What's extracted also decides the match
+                            matched = bool(extracted)
+                        else:
+                            matched = matches is None or matches(word)
                             
-                            # Add the matched line
-                            context_lines.append({"line": i+1, "content": line_stripped, "type": "match"})
+                        if matched:
+                            matched_count += 1
                             
-                            # Add after lines
-                            end_idx = min(len(lines), i + query.modifiers.context_lines + 1)
-                            context_lines.extend([
-                                {"line": j+1, "content": lines[j].rstrip("\n"), "type": "after"}
-                                for j in range(i+1, end_idx)
-                            ])
+                            if find_words:
+                                add_match(i+1, word)
+                                
+                            if extract_all:
+                                if not extraction_decides:
+                                    extracted = extract_all(word)
+                                for ex in extracted:
+                                    if isinstance(ex, tuple):
+                                        add_extracted(" ".join(ex))
+                                    else:
+                                        add_extracted(ex)
+                                        
+                results["matched_count"] = matched_count
+            else:  # TargetType.LINES
+                context_size = query.modifiers.context_lines if collect_matches else 0
+                before = deque(maxlen=context_size)  # The latest (index, line) pairs
+                waiting = deque()  # [line, content, context, after lines still to come] until the context is complete
+                
+                # The loop only touches locals; the count goes into the results at the end
+                matched_count = 0
+                remember = before.append
+                
+                for i, line_stripped in numbered_lines:
+                    if waiting:
+                        # Add this line as after context to the matches still waiting for some
+                        for entry in waiting:
+                            entry[2].append((i+1, line_stripped, "after"))
+                            entry[3] -= 1
+                        while waiting and not waiting[0][3]:
+                            add_match(*waiting.popleft()[:3])
                             
-                            results["matched_items"].append({"line": i+1, "content": line_stripped, "context": context_lines})
-                        else:
-                            results["matched_items"].append({"line": i+1, "content": line_stripped})
-                    
-                    if query.command == CommandType.EXTRACT and query.extraction_pattern:
-                        extracted = re.findall(query.extraction_pattern, line_stripped, flags=flags)
-                        for ex in extracted:
-                            if isinstance(ex, tuple):
-                                results["extracted_items"].append(" ".join(ex))
+                    if extraction_decides:
+                        extracted = extract_all(line_stripped)  # What's extracted also decides the match
+                        matched = bool(extracted)
+                    else:
+                        matched = matches is None or matches(line_stripped)
+                        
+                    if matched:
+                        matched_count += 1
+                        
+                        if collect_matches:
+                            if context_size > 0:
+                                # Before lines and the matched line; after lines are added as they're read
+                                context_lines = [(j+1, line, "before") for j, line in before]
+                                context_lines.append((i+1, line_stripped, "match"))
+                                waiting.append([i+1, line_stripped, context_lines, context_size])
                             else:
-                                results["extracted_items"].append(ex)
-                    
+                                add_match(i+1, line_stripped)
+                        
+                        if extract_all:
+                            if not extraction_decides:
+                                extracted = extract_all(line_stripped)
+                            for ex in extracted:
+                                if isinstance(ex, tuple):
+                                    add_extracted(" ".join(ex))
+                                else:
+                                    add_extracted(ex)
+                                    
+                    if context_size:
+                        remember((i, line_stripped))
+                        
+                # Matches near the end have fewer after lines
+                for entry in waiting:
+                    add_match(*entry[:3])
+                results["matched_count"] = matched_count
+        finally:
+            if own_file:
+                input_file.close()
+                
+        if streaming:
+            if pending:
+                flush_pending()
+            output.flush()
+            
         return results
     
     @staticmethod
-    def _matches_item(item: str, include_pattern: str, exclude_patterns: list, flags: int) -> bool:
-        """Return True if item matches include_pattern and doesn't match any exclude_pattern"""
-        # Check include pattern
-        if not re.search(include_pattern, item, flags=flags):
-            return False
+    def _execute_count(query: Query, numbered_lines: Iterator[Tuple[int, str]],
+                       matches: Optional[Predicate], flags: int) -> int:
+        """Count the lines or words that match the query"""
+        # The per-item loop runs inside map()/sum() instead of Python bytecode
+        lines = map(operator.itemgetter(1), numbered_lines)
+        if query.target == TargetType.WORDS:
+            if matches is None:
+                return sum(map(len, map(str.split, lines)))
+                
+            # Lines can be passed over unsplit when no word in them could match
+            if QueryBuilder.includes_imply_line_match(query):
+                lines = filter(QueryBuilder.build_matcher(query, flags, excludes=False), lines)
+            return sum(sum(map(bool, map(matches, line.split()))) for line in lines)
             
-        # Check exclude patterns
-        for pattern in exclude_patterns:
-            if re.search(pattern, item, flags=flags):
-                return False
+        if matches is None:
+            return sum(1 for _ in lines)
+        return sum(map(bool, map(matches, lines)))
+        
+    @staticmethod
+    def _iter_blocks(input_file) -> Iterator[str]:
+        """Yield the text of a binary file in large decoded blocks that end on line boundaries"""
+        # Large regular files are mapped and decoded in place, with no read
+        # buffers to fill and join
+        try:
+            info = os.fstat(input_file.fileno())
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            info = None
+        if info and stat.S_ISREG(info.st_mode) and info.st_size > BLOCK_SIZE:
+            with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield from QueryExecutor._iter_mapped_blocks(mapped)
+            return
+            
+        # The partial last line is held back in pieces until a later read
+        # completes it, so a very long line isn't copied again on every read
+        pieces = []
+        while True:
+            data = input_file.read(BLOCK_SIZE)
+            if not data:
+                break
+            cut = data.rfind(b"\n") + 1
+            if not cut:
+                pieces.append(data)
+                continue
+                
+            if pieces:
+                pieces.append(data[:cut])
+                block = b"".join(pieces)
+            else:
+                block = data[:cut]
+            pieces = [data[cut:]]
+            yield QueryExecutor._decode_block(block)
+            
+        # A trailing run of undecodable bytes is not a line of its own
+        text = QueryExecutor._decode_block(b"".join(pieces))
+        if text:
+            yield text
+            
+    @staticmethod
+    def _iter_text_lines(input_file) -> Iterator[str]:
+        """Yield the lines of a text stream without their newlines, reading it in large chunks"""
+        # The partial line is kept in pieces and only joined once a chunk
+        # completes it, so a very long line isn't copied again on every read
+        pieces = []
+        while True:
+            chunk = input_file.read(BLOCK_SIZE)
+            if not chunk:
+                break
+            if "\n" not in chunk:
+                pieces.append(chunk)
+                continue
+                
+            lines = chunk.split("\n")
+            if pieces:
+                pieces.append(lines[0])
+                lines[0] = "".join(pieces)
+            pieces = [lines.pop()]  # A partial line until a later chunk completes it
+            yield from lines
+            
+        tail = "".join(pieces)
+        if tail:
+            yield tail
+            
+    @staticmethod
+    def _iter_mapped_blocks(mapped: mmap.mmap) -> Iterator[str]:
+        """Yield the text of a mapped file in decoded blocks of about BLOCK_SIZE that end on line boundaries"""
+        size = len(mapped)
+        start = 0
+        with memoryview(mapped) as view:
+            while start < size:
+                # Cut after the last newline in the block, or the first one past it for very long lines
+                cut = size
+                if start + BLOCK_SIZE < size:
+                    cut = mapped.rfind(b"\n", start, start + BLOCK_SIZE) + 1 or mapped.find(b"\n", start + BLOCK_SIZE) + 1 or size
+                    
+                # A trailing run of undecodable bytes is not a line of its own
+                text = QueryExecutor._decode_block(view[start:cut])
+                if text:
+                    yield text
+                start = cut
+                
+    @staticmethod
+    def _scan_candidates(blocks: Iterator[str], scan_re: re.Pattern) -> Iterator[Tuple[int, str]]:
+        """Yield (line index, line) for every line of the blocks in which scan_re finds a match"""
+        first_line = 0
+        for block in blocks:
+            yield from QueryExecutor._scan_block(block, scan_re, first_line)
+            first_line += block.count("\n") + (not block.endswith("\n"))
+            
+    @staticmethod
+    def _scan_block(block: str, scan_re: re.Pattern, first_line: int) -> Iterator[Tuple[int, str]]:
+        """Yield (line index, line) for every line of one block in which scan_re finds a match"""
+        search = scan_re.search
+        line_no = first_line
+        counted = 0
+        pos = 0
+        
+        while pos < len(block):
+            m = search(block, pos)
+            if not m:
+                break
+                
+            # Widen the hit to the line it starts in and move on to the next line
+            start = block.rfind("\n", 0, m.start()) + 1
+            end = block.find("\n", m.start())
+            if end < 0:
+                end = len(block)
+                
+            line_no += block.count("\n", counted, start)
+            counted = start
+            yield line_no, block[start:end]
+            pos = end + 1
+            
+    @staticmethod
+    def _find_candidates(blocks: Iterator[str], needle: str,
+                         fold_re: Optional[re.Pattern] = None) -> Iterator[Tuple[int, str]]:
+        """Yield (line index, line) for every line of the blocks that contains needle
+
+        With fold_re, needle is lowercase and looked for in lowercased ASCII
+        blocks; other blocks are searched with fold_re instead.
+        """
+        first_line = 0
+        for block in blocks:
+            if fold_re and not block.isascii():
+                yield from QueryExecutor._scan_block(block, fold_re, first_line)
+                first_line += block.count("\n") + (not block.endswith("\n"))
+                continue
                 
-        return True
+            # Lowercasing keeps an ASCII block's offsets, so lines are cut from the original
+            find = block.lower().find if fold_re else block.find
+            line_no = first_line
+            counted = 0
+            pos = find(needle)
+            
+            while pos >= 0:
+                # Widen the hit to its line and look again from the next one
+                start = block.rfind("\n", 0, pos) + 1
+                end = find("\n", pos)
+                if end < 0:
+                    end = len(block)
+                    
+                line_no += block.count("\n", counted, start)
+                counted = start
+                yield line_no, block[start:end]
+                pos = find(needle, end + 1)
+                
+            first_line += block.count("\n") + (not block.endswith("\n"))
+            
+    @staticmethod
+    def _count_literal_lines(blocks: Iterator[str], needle: str, fold_re: Optional[re.Pattern] = None) -> int:
+        """Count the lines of the blocks that contain needle, folding case as _find_candidates does"""
+        count = 0
+        for block in blocks:
+            if fold_re:
+                if not block.isascii():
+                    count += sum(1 for _ in QueryExecutor._scan_block(block, fold_re, 0))
+                    continue
+                block = block.lower()
+            find = block.find
+            pos = find(needle)
+            while pos >= 0:
+                count += 1
+                # Carry on from the start of the next line
+                pos = find("\n", pos)
+                if pos < 0:
+                    break
+                pos = find(needle, pos + 1)
+        return count
+        
+    @staticmethod
+    def _decode_block(data: Union[bytes, memoryview]) -> str:
+        """Decode raw input the same way text-mode reading with universal newlines would"""
+        text = str(data, "utf-8", "ignore")
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text
+        
+    @staticmethod
+    def _split_lines(text: str) -> List[str]:
+        """Split decoded text into lines without their newline characters"""
+        lines = text.split("\n")
+        if text.endswith("\n"):
+            lines.pop()  # Nothing follows the final newline
+        return lines
         
 # Output formatter class for different output formats
 class OutputFormatter:
+    # Marks for before, matched and after lines of a context block
+    CONTEXT_PREFIXES = {"before": "- ", "match": "> ", "after": "+ "}
+    
     @staticmethod
-    def format_results(results: Dict[str, Any], format_type: str) -> str:
-        """Format results in the specified format"""
+    def format_results(results: Dict[str, Any], format_type: str, compact: bool = False) -> str:
+        """Format results in the specified format, without indentation for compact JSON"""
         if format_type == "json":
-            return json.dumps(results, indent=2)
+            if compact:
+                return OutputFormatter.dumps_compact(OutputFormatter.nest_matches(results))
+            return json.dumps(OutputFormatter.nest_matches(results), indent=2)
         elif format_type == "csv":
             # Basic CSV output
             output = []
@@ -555,8 +1301,8 @@ class OutputFormatter:
                     output.append(f"{item}")
             else:  # FIND
                 output.append(f"Line,Content")
-                for item in results["matched_items"]:
-                    output.append(f"{item['line']},\"{item['content'].replace('\"', '\"\"')}\"")
+                for line, content in zip(results["match_lines"], results["match_contents"]):
+                    output.append(f"{line},\"{content.replace('\"', '\"\"')}\"")
                     
             return "\n".join(output)
         else:  # text (default)
@@ -565,29 +1311,52 @@ class OutputFormatter:
             elif results["command"] == "EXTRACT":
                 return "\n".join(results["extracted_items"])
             else:  # FIND
-                output = []
-                for item in results["matched_items"]:
-                    if "context" in item:
-                        # Add separator before context blocks
-                        output.append("\n" + "-" * 40)
-                        
-                        for ctx_line in item["context"]:
-                            prefix = ""
-                            if ctx_line["type"] == "before":
-                                prefix = "- "
-                            elif ctx_line["type"] == "match":
-                                prefix = "> "
-                            elif ctx_line["type"] == "after":
-                                prefix = "+ "
-                                
-                            output.append(f"{prefix}{ctx_line['line']}: {ctx_line['content']}")
-                            
-                        # Add separator after context blocks
-                        output.append("-" * 40)
-                    else:
-                        output.append(f"{item['line']}: {item['content']}")
-                        
-                return "\n".join(output)
+                return "\n".join(map(OutputFormatter.format_text_item, results["match_lines"],
+                                      results["match_contents"], results["match_contexts"]))
+                
+    @staticmethod
+    def dumps_compact(obj: Any) -> str:
+        """Serialize to JSON on one line, with orjson when it's installed"""
+        if orjson:
+            return orjson.dumps(obj).decode()
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))  # Same text orjson writes
+        
+    @staticmethod
+    def nest_matches(results: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn the match columns of the results back into one dict per match, context included"""
+        matched_items = []
+        for line, content, context in zip(results["match_lines"], results["match_contents"],
+                                          results["match_contexts"]):
+            item = {"line": line, "content": content}
+            if context is not None:
+                item["context"] = [{"line": j, "content": text, "type": kind} for j, text, kind in context]
+            matched_items.append(item)
+            
+        return {
+            "command": results["command"],
+            "target": results["target"],
+            "matched_count": results["matched_count"],
+            "matched_items": matched_items,
+            "extracted_items": results["extracted_items"]
+        }
+        
+    @staticmethod
+    def format_text_item(line: int, content: str, context: Optional[List[Tuple[int, str, str]]] = None) -> str:
+        """Format a single FIND match (with its context block, if any) as text"""
+        if context is None:
+            return f"{line}: {content}"
+            
+        # Add separator before context blocks
+        output = ["\n" + "-" * 40]
+        append = output.append
+        prefixes = OutputFormatter.CONTEXT_PREFIXES
+        
+        for j, text, kind in context:
+            append(f"{prefixes.get(kind, '')}{j}: {text}")
+            
+        # Add separator after context blocks
+        append("-" * 40)
+        return "\n".join(output)
 
 # Interactive mode implementation
 def interactive_mode():
@@ -639,15 +1408,13 @@ def interactive_mode():
                 
             # Parse and execute the query
             try:
-                parser = Parser(query_text)
-                query = parser.parse()
+                query = parse_query(query_text)
                 
-                # If no file specified, use stdin with a prompt
+                # If no file specified, use stdin with a prompt. It's read as
+                # the query runs rather than copied into memory first
                 if not query.file_pattern:
                     print("Enter text (press Ctrl+D when finished):")
-                    input_text = sys.stdin.read()
-                    from io import StringIO
-                    input_source = StringIO(input_text)
+                    input_source = sys.stdin
                 else:
                     input_source = None
                     
@@ -680,6 +1447,7 @@ def main():
     parser.add_argument("-i", "--interactive", action="store_true", help="Run in interactive mode")
     parser.add_argument("-o", "--output", choices=["text", "json", "csv"], default="text", 
                       help="Output format")
+    parser.add_argument("--compact", action="store_true", help="Write JSON output on one line, without indentation")
     
     args = parser.parse_args()
     
@@ -689,8 +1457,7 @@ def main():
         
     if args.query:
         try:
-            query_parser = Parser(args.query)
-            query = query_parser.parse()
+            query = parse_query(args.query)
             
             # Override file if specified on command line
             if args.file:
@@ -700,14 +1467,17 @@ def main():
             if args.output:
                 query.output_format = args.output
                 
-            results = QueryExecutor.execute(query)
+            # Text output is streamed as matches are found; other formats need the full results
+            streaming = query.output_format == "text" and query.command != CommandType.COUNT
+            results = QueryExecutor.execute(query, output=sys.stdout if streaming else None)
             
             if "error" in results:
                 print(f"Error: {results['error']}", file=sys.stderr)
                 sys.exit(1)
                 
-            output = OutputFormatter.format_results(results, query.output_format)
-            print(output)
+            if not streaming:
+                output = OutputFormatter.format_results(results, query.output_format, args.compact)
+                print(output)
             
         except Exception as e:
             print(f"Error: {str(e)}", file=sys.stderr)
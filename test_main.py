@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+import unittest
+
+from Main import QueryBuilder
+
+# (pattern, whether it can backtrack catastrophically)
+REDOS_CASES = [
+    # A repeated group that can end in an unbounded repeat
+    (r"(a+)+$", True),
+    (r"(a*)*", True),
+    (r"(\w+\s?)+", True),
+    (r"((a+))*", True),
+    (r"((ab)+)+", True),
+    (r"(a+){2,}", True),
+    (r"(a+)*?", True),
+    (r"(a+|b)+", True),
+    (r"(a+b{0,2})*", True),
+    (r"([]a]+)+", True),
+    # Something required ends every iteration
+    (r"(\w+\.)+\w+", False),
+    (r"([a-z0-9]+\.)+[a-z]{2,}", False),
+    (r"(\d+,)*\d+", False),
+    (r"([^,]+,)+", False),
+    (r"((ab)+c)+", False),
+    # No repeat inside, a bounded outer repeat, or no backtracking
+    (r"(?:a|b)+", False),
+    (r"a+b+", False),
+    (r"(a+)?", False),
+    (r"(a+){2,5}", False),
+    (r"(a++)+", False),
+    (r"(?>a+)+", False),
+    (r"(a+)++", False),
+    (r"(?:x){2,}+", False),
+    # Quantifiers that are escaped or inside a class don't count
+    (r"[(a+)]+", False),
+    (r"\(a+\)+", False),
+    (r"(a{})+", False),
+]
+
+class RedosRiskTest(unittest.TestCase):
+    def test_is_redos_risk(self):
+        for pattern, risky in REDOS_CASES:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(QueryBuilder._is_redos_risk(pattern), risky)
+
+if __name__ == "__main__":
+    unittest.main()